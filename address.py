@@ -0,0 +1,90 @@
+"""
+Address canonicalization
+
+Turns the many spellings of a Brazilian address into one stable key, so that
+"AV. JULIO SCHEIBE, 1065" and "Avenida Júlio Scheibe nº 1065" share a cache
+entry and a single lookup. Keys are only used for caching and deduplication,
+the address sent to the API is left untouched.
+
+canonicalize_addresses() works on a whole pandas Series in one pass and
+canonical_address() on a single string; both apply the same rules.
+query_addresses() builds the strings that are actually sent, and
+select_queries() picks the rows of a frame that need one.
+"""
+
+import re
+import unicodedata
+import numpy as np
+
+# Street types and titles as they are abbreviated in cadastral files
+ABBREVIATIONS = {
+    'AV': 'AVENIDA', 'AVEN': 'AVENIDA', 'AVN': 'AVENIDA',
+    'TV': 'TRAVESSA', 'TRAV': 'TRAVESSA',
+    'ROD': 'RODOVIA',
+    'AL': 'ALAMEDA',
+    'EST': 'ESTRADA', 'ESTR': 'ESTRADA',
+    'PC': 'PRACA', 'PCA': 'PRACA', 'PRC': 'PRACA',
+    'LG': 'LARGO', 'LGO': 'LARGO',
+    'VL': 'VILA',
+    'JD': 'JARDIM', 'JRD': 'JARDIM',
+    'PQ': 'PARQUE', 'PRQ': 'PARQUE',
+    'CJ': 'CONJUNTO', 'CONJ': 'CONJUNTO',
+    'STA': 'SANTA', 'STO': 'SANTO',
+    'DR': 'DOUTOR', 'PROF': 'PROFESSOR',
+    'CEL': 'CORONEL', 'CAP': 'CAPITAO', 'TEN': 'TENENTE', 'SGT': 'SARGENTO',
+    'GAL': 'GENERAL', 'GEN': 'GENERAL', 'MAL': 'MARECHAL',
+    'PRES': 'PRESIDENTE', 'GOV': 'GOVERNADOR', 'SEN': 'SENADOR', 'DEP': 'DEPUTADO', 'VER': 'VEREADOR',
+}
+
+_NON_ALPHANUMERIC = re.compile(r'[^A-Z0-9]+')
+# "NO 1065" (from Nº), "NO. 1065", "NUMERO 1065"; a bare N only right after a comma,
+# since "RUA N, 5" names street N
+_NUMBER_MARKER = re.compile(r'(?:,\s*N\b|\b(?:NO|NUM|NUMERO)\b)\W*(?=\d)')
+# A lone R only means RUA at the start of the address
+_LEADING_RUA = re.compile(r'^R\b')
+_ABBREVIATION = re.compile(r'\b(' + '|'.join(sorted(ABBREVIATIONS, key=len, reverse=True)) + r')\b')
+_SPACES = re.compile(r' +')
+
+
+def _expand(match):
+    return ABBREVIATIONS[match.group(1)]
+
+
+def fold_accents(text):
+    """Strip diacritics, e.g. 'JÚLIO' -> 'JULIO'"""
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+
+
+def canonical_address(text):
+    """Canonical key for a single address"""
+    text = fold_accents(text).upper()
+    text = _NUMBER_MARKER.sub(' ', text)
+    text = _NON_ALPHANUMERIC.sub(' ', text)
+    text = _LEADING_RUA.sub('RUA', text.strip())
+    text = _ABBREVIATION.sub(_expand, text)
+    return _SPACES.sub(' ', text).strip()
+
+
+def canonicalize_addresses(addresses):
+    """Canonical keys for a Series of addresses, missing values stay missing"""
+    s = addresses.astype(object).where(addresses.notna())
+    s = s.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii').str.upper()
+    s = s.str.replace(_NUMBER_MARKER, ' ', regex=True)
+    s = s.str.replace(_NON_ALPHANUMERIC, ' ', regex=True)
+    s = s.str.strip().str.replace(_LEADING_RUA, 'RUA', regex=True)
+    s = s.str.replace(_ABBREVIATION, _expand, regex=True)
+    return s.str.replace(_SPACES, ' ', regex=True).str.strip()
+
+
+def query_addresses(addresses):
+    """API query for each address in a Series: dashes and "P/" dropped, state appended"""
+    return addresses.str.replace('-', '', regex=False).str.replace('P/', '', regex=False) + ' PARANA'
+
+
+def select_queries(df):
+    """Positions of the rows of df missing the_geom that have an endereco, and the API query of each
+
+    Rows without an address have nothing to look up and are left out.
+    """
+    missing = (df['the_geom'].isna() & df['endereco'].notna()).to_numpy()
+    return np.flatnonzero(missing), query_addresses(df['endereco'][missing])
@@ -0,0 +1,196 @@
+import asyncio
+import time
+import aiohttp
+from geocode_client import (geocode_url, parse_geocode_response, get_rate_limiter, get_circuit_breaker,
+                            get_concurrency_limiter, get_hedge_policy, get_coalescer, address_key,
+                            cached_geocode, store_geocode,
+                            get_retry_policy, get_request_timeout, is_overload_status, status_error,
+                            GeocodeRequestError)
+
+DEFAULT_CONCURRENCY = 100
+
+
+class AdaptiveGate:
+    """asyncio front end for a flow_control.AdaptiveLimiter"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._changed = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._changed:
+            await self._changed.wait_for(self.limiter.try_acquire)
+
+    async def release(self, latency, overloaded=False):
+        self.limiter.release(latency, overloaded)
+        async with self._changed:
+            self._changed.notify_all()
+
+
+async def _request_async(session, endereco, api_type, gate):
+    """Async counterpart of geocode_client._request"""
+    if gate is not None:
+        await gate.acquire()
+    start = time.monotonic()
+    overloaded = False
+    cancelled = False
+    try:
+        async with session.get(geocode_url(api_type), params={'address': endereco}) as response:
+            overloaded = is_overload_status(response.status)
+            if response.status != 200:
+                raise status_error(response.status, response.headers.get('Retry-After'))
+            # The proxy does not always label its responses as JSON
+            data = await response.json(content_type=None)
+            return parse_geocode_response(data, api_type)
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+        overloaded = True
+        raise GeocodeRequestError(str(e) or type(e).__name__, retryable=True) from e
+    except asyncio.CancelledError:
+        # The losing side of a hedge says nothing about the server's health
+        cancelled = True
+        raise
+    finally:
+        if gate is not None:
+            await gate.release(None if cancelled else time.monotonic() - start, overloaded)
+
+
+async def _timed_request_async(session, endereco, api_type, gate, policy):
+    start = time.monotonic()
+    data = await _request_async(session, endereco, api_type, gate)
+    policy.record(time.monotonic() - start)
+    return data
+
+
+async def _hedged_request_async(session, endereco, api_type, gate):
+    """Async counterpart of geocode_client._hedged_request, cancelling the losing request"""
+    policy = get_hedge_policy()
+    if policy is None:
+        return await _request_async(session, endereco, api_type, gate)
+    delay = policy.delay()
+    if delay is None:
+        return await _timed_request_async(session, endereco, api_type, gate, policy)
+
+    primary = asyncio.ensure_future(_timed_request_async(session, endereco, api_type, gate, policy))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    limiter = get_rate_limiter(api_type)
+    if done or not policy.try_hedge() or (limiter is not None and not limiter.try_acquire()):
+        return await primary
+
+    backup = asyncio.ensure_future(_timed_request_async(session, endereco, api_type, gate, policy))
+    pending = {primary, backup}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                if not isinstance(task.exception(), GeocodeRequestError):
+                    raise task.exception()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def fetch_geocode_async(session, endereco, api_type='geoapify', gate=None):
+    """Async counterpart of geocode_client.fetch_geocode
+
+    Args:
+        session: aiohttp.ClientSession shared by all lookups
+        endereco: Address to geocode
+        api_type: 'geoapify' or 'google'
+        gate: Optional AdaptiveGate bounding in-flight requests
+    """
+    key = address_key(endereco, api_type)
+    data = cached_geocode(key)
+    if data is not None:
+        return data
+    return await get_coalescer().do_async(key, _fetch_and_store_async, key, session, endereco, api_type, gate)
+
+
+async def _fetch_and_store_async(key, session, endereco, api_type, gate):
+    try:
+        data = await _fetch_geocode_async(session, endereco, api_type, gate)
+    except GeocodeRequestError:
+        return None
+    store_geocode(key, data)
+    return data
+
+
+async def _fetch_geocode_async(session, endereco, api_type, gate):
+    """Async counterpart of geocode_client._fetch_geocode"""
+    limiter = get_rate_limiter(api_type)
+    breaker = get_circuit_breaker(api_type)
+    policy = get_retry_policy()
+    attempt = 1
+    while True:
+        if breaker is not None:
+            wait = breaker.before_request()
+            if wait > 0:
+                if breaker.fail_fast:
+                    raise GeocodeRequestError(f"circuit for {api_type} is open", retryable=True)
+                await asyncio.sleep(wait)
+                continue
+        if limiter is not None:
+            delay = limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        try:
+            data = await _hedged_request_async(session, endereco, api_type, gate)
+        except GeocodeRequestError as e:
+            if breaker is not None:
+                breaker.record(healthy=not e.retryable)
+            if not e.retryable:
+                raise
+            if attempt >= policy.max_attempts:
+                print(f"Error fetching geocode for {endereco}: {e} (gave up after {attempt} attempts)")
+                raise
+            await asyncio.sleep(policy.delay(attempt, e.retry_after))
+            attempt += 1
+        except Exception as e:
+            if breaker is not None:
+                breaker.record(healthy=True)
+            print(f"Error fetching geocode for {endereco}: {e}")
+            raise GeocodeRequestError(str(e)) from e
+        else:
+            if breaker is not None:
+                breaker.record(healthy=True)
+            return data
+
+
+async def _geocode_all(addresses, api_type, concurrency, on_result):
+    limiter = get_concurrency_limiter()
+    gate = AdaptiveGate(limiter) if limiter is not None else None
+    # Room for a hedge next to every lookup, so the backup does not queue behind the request it races
+    connections = concurrency * (2 if get_hedge_policy() is not None else 1)
+    connector = aiohttp.TCPConnector(limit=connections, limit_per_host=connections)
+    timeout = aiohttp.ClientTimeout(total=get_request_timeout())
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        # A fixed set of workers pulling from one iterator keeps `concurrency` lookups
+        # in flight without creating a task per address upfront
+        addresses = iter(addresses)
+
+        async def worker():
+            for endereco in addresses:
+                # One bad address is reported and left empty, as the thread engine does, instead of
+                # stopping every worker
+                try:
+                    on_result(endereco, await fetch_geocode_async(session, endereco, api_type, gate))
+                except Exception as e:
+                    print(f"Error processing {endereco}: {e}")
+                    on_result(endereco, None)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def geocode_all(addresses, api_type, on_result, concurrency=DEFAULT_CONCURRENCY):
+    """Geocode every address, from any iterable, from a single event loop
+
+    on_result(endereco, data) is called on the loop thread as each lookup completes,
+    with at most `concurrency` requests in flight at any time, fewer while an
+    adaptive concurrency limiter is configured in geocode_client.
+    """
+    asyncio.run(_geocode_all(addresses, api_type, concurrency, on_result))
@@ -0,0 +1,70 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from address import select_queries
+
+STREETS = ['R. DAS FLORES', 'AV. JULIO SCHEIBE', 'AVENIDA JÚLIO SCHEIBE', 'TV. SANTOS DUMONT', 'R. XV DE NOVEMBRO',
+           'ROD. PR-412', 'AL. DOM PEDRO II', 'PCA. TIRADENTES']
+DISTRICTS = ['CENTRO', 'CAIOBA', 'PRAIA DE LESTE', 'IPANEMA', 'SHANGRI-LA']
+
+
+def make_input(path, rows, seed=0):
+    """Write a cadastral-style CSV where a third of the_geom values are missing
+
+    Every row has an address, the loop main.py used to run fails on one without.
+    """
+    rng = np.random.default_rng(seed)
+    streets = np.array(STREETS, dtype=object)[rng.integers(len(STREETS), size=rows)]
+    numbers = rng.integers(1, 3000, size=rows).astype(str)
+    districts = np.array(DISTRICTS, dtype=object)[rng.integers(len(DISTRICTS), size=rows)]
+    endereco = streets + ', ' + numbers + ' - P/ ' + districts
+    the_geom = pd.Series('POINT(450000.0 7190000.0)', index=range(rows))
+    the_geom[rng.random(rows) < 0.33] = None
+    pd.DataFrame({'inscricao': np.arange(rows), 'endereco': endereco, 'the_geom': the_geom}).to_csv(
+        path, sep=';', index=False)
+
+
+def preprocess_loop(df, done=None, first_row=0):
+    """Row selection and query building as main.py did it before, one row at a time"""
+    done = done or {}
+    rows_to_process = []
+    queries = []
+    for row_idx, row in enumerate(df.itertuples()):
+        if pd.isna(row.the_geom):
+            if first_row + row_idx in done:
+                continue
+            rows_to_process.append(row_idx)
+            queries.append(row.endereco.replace('-', '').replace('P/', '') + ' PARANA')
+    return rows_to_process, queries
+
+
+def best_of(fn, df, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(df)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare row-by-row and vectorized preprocessing in main.py')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Rows in the synthetic input (default: 1000000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per variant, the best one counts (default: 3)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'synthetic.csv')
+        make_input(path, args.rows)
+        df = pd.read_csv(path, sep=';', dtype={'endereco': str, 'the_geom': str})
+
+    loop_time, (loop_rows, loop_queries) = best_of(preprocess_loop, df, args.repeat)
+    vectorized_time, (rows, queries) = best_of(select_queries, df, args.repeat)
+    assert loop_rows == rows.tolist() and loop_queries == queries.tolist(), 'results differ'
+
+    print(f"{args.rows} rows, {len(rows)} to geocode")
+    print(f"itertuples loop: {loop_time:.3f}s")
+    print(f"vectorized:      {vectorized_time:.3f}s ({loop_time / vectorized_time:.1f}x faster)")
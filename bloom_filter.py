@@ -0,0 +1,83 @@
+import hashlib
+import math
+import struct
+import threading
+import numpy as np
+
+BLOOM_MAGIC = b'GEOBLM01'
+BLOOM_HEADER = struct.Struct('<8sQQ16s')  # magic, bit count, hash count, fingerprint of the cache it mirrors
+_MASK = (1 << 64) - 1
+
+
+def _hash_pair(key):
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    # An odd step keeps the k probes distinct for any bit count
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+class BloomFilter:
+    """Bloom filter over byte strings backed by a NumPy bit array
+
+    Answers "definitely not present" or "maybe present", with a false positive
+    rate close to `error_rate` while it holds at most `capacity` keys. Probes
+    use double hashing over a 128-bit blake2b digest, so filters saved to disk
+    stay valid across processes.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.bit_count = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = np.zeros((self.bit_count + 7) // 8, dtype=np.uint8)
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        h1, h2 = _hash_pair(key)
+        return [((h1 + i * h2) & _MASK) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+
+    def update(self, keys):
+        """Add many keys at once, setting their bits with vectorized NumPy operations"""
+        pairs = np.array([_hash_pair(key) for key in keys], dtype=np.uint64).reshape(-1, 2)
+        steps = np.arange(self.hash_count, dtype=np.uint64)
+        # uint64 arithmetic wraps exactly like the masked Python version in _positions
+        positions = (pairs[:, :1] + steps * pairs[:, 1:]) % np.uint64(self.bit_count)
+        positions = positions.ravel()
+        with self._lock:
+            np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                             (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def save(self, path, fingerprint):
+        """Write the filter to path, tagged with the fingerprint of the data it was built from"""
+        with self._lock:
+            with open(path, 'wb') as f:
+                f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.bit_count, self.hash_count, fingerprint))
+                f.write(self.bits.tobytes())
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        """Read a filter written by save, or return None if it is missing, corrupt or stale"""
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(BLOOM_HEADER.size)
+                magic, bit_count, hash_count, saved_fingerprint = BLOOM_HEADER.unpack(header)
+                bits = np.frombuffer(f.read(), dtype=np.uint8).copy()
+        except (OSError, struct.error):
+            return None
+        if magic != BLOOM_MAGIC or saved_fingerprint != fingerprint or len(bits) != (bit_count + 7) // 8:
+            return None
+        bloom = cls.__new__(cls)
+        bloom.bit_count = bit_count
+        bloom.hash_count = hash_count
+        bloom.bits = bits
+        bloom._lock = threading.Lock()
+        return bloom
@@ -0,0 +1,68 @@
+import json
+import os
+import threading
+
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+
+class CheckpointJournal:
+    """Append-only record of the rows of one input file that are done
+
+    Every line is a JSON array [row number, [[lng, lat], ...]]: the points
+    found for that row, the first one for the row itself and the others for
+    the extra rows it gets, or none when the API found nothing. Lines are
+    buffered and a background thread writes them out every `flush_interval`
+    seconds, whether or not rows keep coming, so a crash loses at most that
+    much work; a line cut short by the crash is ignored on load.
+
+    Args:
+        path: Journal file, appended to if it exists
+        flush_interval: Seconds between flushes to the OS, 0 flushes every line
+    """
+
+    def __init__(self, path, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_periodically, name='checkpoint-flush', daemon=True)
+            self._flusher.start()
+
+    @staticmethod
+    def load(path):
+        """Points of every row recorded in path, {row number: [[lng, lat], ...]}"""
+        done = {}
+        if not os.path.exists(path):
+            return done
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row, coordinates = json.loads(line)
+                except ValueError:
+                    continue
+                done[row] = coordinates
+        return done
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                self._file.flush()
+
+    def record(self, row, coordinates):
+        with self._lock:
+            self._file.write(json.dumps([row, coordinates], separators=(',', ':')) + '\n')
+            if self._flusher is None:
+                self._file.flush()
+
+    def close(self, remove=False):
+        """Flush and close the journal, deleting it when the run it covers has finished"""
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            self._file.close()
+        if remove:
+            os.remove(self.path)
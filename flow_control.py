@@ -0,0 +1,337 @@
+import asyncio
+import concurrent.futures
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second
+
+    Tokens are reserved rather than waited for: a caller that finds the bucket
+    empty takes a token on credit and is told how long to wait, so concurrent
+    callers queue up at exactly `rate` requests per second instead of racing
+    each other when the bucket refills.
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token and return the number of seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def try_acquire(self):
+        """Take a token only if one is available right now"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def acquire(self):
+        """Block the calling thread until a token is available"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AdaptiveLimiter:
+    """AIMD limit on the number of in-flight requests
+
+    The limit grows by roughly one slot per round trip while responses stay
+    fast, and is multiplied by `backoff` when the server reports overload
+    (timeouts, 5xx, 429). Latency counts as healthy while the smoothed latency
+    stays within `latency_tolerance` times the best latency seen so far.
+    """
+
+    def __init__(self, initial=10, min_limit=1, max_limit=100, latency_tolerance=2.0, backoff=0.5):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.in_flight = 0
+        self.smoothed_latency = None
+        self.baseline_latency = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    def try_acquire(self):
+        """Take a slot if one is free, without blocking"""
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        """Block the calling thread until a slot is free"""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, overloaded=False):
+        """Return a slot and adjust the limit from the request outcome
+
+        A latency of None returns the slot without judging the server, for
+        requests abandoned before they completed.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+            if latency is None:
+                return
+            now = time.monotonic()
+            if overloaded:
+                # Requests in flight when the server started struggling fail together,
+                # so only back off once per round trip
+                window = self.smoothed_latency or latency
+                if now - self._last_decrease >= window:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+            else:
+                if self.smoothed_latency is None:
+                    self.smoothed_latency = latency
+                else:
+                    self.smoothed_latency = 0.9 * self.smoothed_latency + 0.1 * latency
+                if self.baseline_latency is None or self.smoothed_latency < self.baseline_latency:
+                    self.baseline_latency = self.smoothed_latency
+                else:
+                    # Let the baseline creep up so a permanent latency shift does not freeze the limit
+                    self.baseline_latency += (self.smoothed_latency - self.baseline_latency) * 0.001
+                if self.smoothed_latency <= self.baseline_latency * self.latency_tolerance:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter for transient request failures
+
+    Args:
+        max_attempts: Total attempts per request, including the first one
+        base_delay: Backoff ceiling in seconds before the first retry, doubled on every retry
+        max_delay: Upper bound for any single wait, including server supplied Retry-After values
+    """
+
+    # 4xx statuses that mean "try again later" rather than "this request is wrong"
+    RETRYABLE_CLIENT_STATUSES = {408, 425, 429}
+
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=60.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable_status(self, status_code):
+        return status_code >= 500 or status_code in self.RETRYABLE_CLIENT_STATUSES
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait after failed attempt number `attempt` (starting at 1)"""
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker for one upstream provider
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    requests are held back for `reset_timeout` seconds. It then lets up to
+    `half_open_probes` requests through; the first success closes the circuit
+    again, a failure re-opens it for another `reset_timeout`.
+
+    Args:
+        fail_fast: Reject requests while open instead of parking them until the next probe
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_probes=1, fail_fast=False):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.fail_fast = fail_fast
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Return 0 if a request may go out now, else the seconds until it should ask again"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                self._set_state(self.HALF_OPEN)
+            if self.probes_in_flight < self.half_open_probes:
+                self.probes_in_flight += 1
+                return 0.0
+            # Wait for the outstanding probe to decide
+            return min(1.0, self.reset_timeout)
+
+    def record(self, healthy):
+        """Report the outcome of a request allowed by before_request"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            if healthy:
+                self.failures = 0
+                if self.state != self.CLOSED:
+                    self._set_state(self.CLOSED)
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        if state == self.OPEN:
+            print(f"Circuit for {self.name} opened after {self.failures} consecutive failures, "
+                  f"probing again in {self.reset_timeout:g}s")
+        elif state == self.CLOSED:
+            print(f"Circuit for {self.name} closed, provider is responding again")
+        self.state = state
+        if state != self.HALF_OPEN:
+            self.probes_in_flight = 0
+
+
+class HedgePolicy:
+    """Decides when a slow request deserves a backup copy
+
+    A request is hedged once it has been running longer than the `percentile`
+    of recently observed latencies, as long as hedges stay below `max_ratio`
+    of all requests. Nothing is hedged until `min_samples` latencies are known.
+    """
+
+    def __init__(self, percentile=95, max_ratio=0.05, min_samples=50, window=1000):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self._threshold = None
+        self._stale = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        """Add the latency of a completed request"""
+        with self._lock:
+            self.samples.append(latency)
+            self._stale += 1
+
+    def delay(self):
+        """Count a new request and return how long to wait before hedging it, or None"""
+        with self._lock:
+            self.requests += 1
+            if len(self.samples) < self.min_samples:
+                return None
+            # Re-sorting the window on every request is wasteful, the percentile moves slowly
+            if self._threshold is None or self._stale >= 20:
+                ordered = sorted(self.samples)
+                index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+                self._threshold = ordered[index]
+                self._stale = 0
+            return self._threshold
+
+    def try_hedge(self):
+        """Claim a hedge if the budget allows it"""
+        with self._lock:
+            if self.hedges + 1 > self.max_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into a single call
+
+    Callers arriving while a call for their key is running wait for it and
+    share its result instead of starting their own. `shared` counts those.
+    do() serves threads, do_async() coroutines on one event loop.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = concurrent.futures.Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, fn, *args):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.shared += 1
+        return await task
+
+
+def submit_bounded(executor, fn, items, window, *args):
+    """Run fn(item, *args) on executor for every item with at most `window` calls in flight
+
+    Items are pulled from the iterable only as earlier calls finish, so a
+    generator of millions of items never turns into millions of pending
+    futures. Yields (item, future) pairs in completion order.
+    """
+    items = iter(items)
+    pending = {executor.submit(fn, item, *args): item for item in itertools.islice(items, window)}
+    while pending:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            item = pending.pop(future)
+            for next_item in itertools.islice(items, 1):
+                pending[executor.submit(fn, next_item, *args)] = next_item
+            yield item, future
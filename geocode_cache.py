@@ -0,0 +1,450 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from bloom_filter import BloomFilter
+
+DEFAULT_CACHE_PATH = 'cache/geocode_cache.sqlite'
+DEFAULT_TTL = 90 * 24 * 3600
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 3600
+DEFAULT_MEMORY_SIZE = 100_000
+DEFAULT_MEMORY_TTL = 3600
+
+# Frozen snapshot layout: header, sorted key hashes, fixed-size index in the same order, then keys and values
+FROZEN_MAGIC = b'GEOFRZ01'
+FROZEN_HEADER = struct.Struct('<8sQ')  # magic, entry count
+FROZEN_HASH = np.dtype('<u8')
+FROZEN_ENTRY = struct.Struct('<QIQId')  # key offset, key length, value offset, value length, created_at
+
+
+def features_to_coordinates(data):
+    """Reduce a normalized response to the list of [lng, lat] pairs it contains"""
+    return [feature.get('geometry').get('coordinates') for feature in data.get('features', [])]
+
+
+def coordinates_to_features(coordinates):
+    """Rebuild a normalized (Geoapify format) response from [lng, lat] pairs"""
+    return {'features': [{'geometry': {'coordinates': c}} for c in coordinates]}
+
+
+def encode_key(provider, address):
+    """Byte form of a cache key, as stored in frozen snapshots and Bloom filters"""
+    return provider.encode('utf-8') + b'\x1f' + address.encode('utf-8')
+
+
+def frozen_key(provider, address):
+    """Encoded key and its stable 64-bit hash, the order of entries in a frozen snapshot"""
+    key = encode_key(provider, address)
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little'), key
+
+
+class GeocodeCache:
+    """Persistent SQLite store of normalized geocode results
+
+    Entries are keyed by provider and normalized address and only keep the
+    feature coordinates, which is all the rest of the pipeline reads.
+    Addresses the provider found nothing for are kept as negative entries
+    (no coordinates) with their own, usually shorter, lifetime.
+
+    Args:
+        path: SQLite database file, created if missing
+        ttl: Seconds after which an entry is ignored and fetched again
+        negative_ttl: Same for negative entries, 0 stops storing them
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # Shared by all worker threads, access is serialized through _lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                provider TEXT NOT NULL,
+                address TEXT NOT NULL,
+                coordinates TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (provider, address)
+            ) WITHOUT ROWID
+        ''')
+
+    def get(self, provider, address):
+        """Return the cached normalized response, or None on a miss or expired entry"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT coordinates, created_at FROM geocode_cache WHERE provider = ? AND address = ?',
+                (provider, address)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            negative = row[0] == '[]'
+            if time.time() - row[1] > (self.negative_ttl if negative else self.ttl):
+                # Expired entries are left in place until a fresh result replaces them
+                self.misses += 1
+                self.evictions += 1
+                return None
+            self.hits += 1
+            if negative:
+                self.negative_hits += 1
+        return coordinates_to_features(json.loads(row[0]))
+
+    def put(self, provider, address, data):
+        coordinates = json.dumps(features_to_coordinates(data), separators=(',', ':'))
+        if coordinates == '[]' and self.negative_ttl <= 0:
+            return
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO geocode_cache (provider, address, coordinates, created_at) VALUES (?, ?, ?, ?)',
+                (provider, address, coordinates, time.time()))
+
+    def keys(self):
+        """Encoded keys of every entry, expired ones included"""
+        with self._lock:
+            rows = self._conn.execute('SELECT provider, address FROM geocode_cache').fetchall()
+        return [encode_key(provider, address) for provider, address in rows]
+
+    def state(self):
+        """Number of entries and fingerprint of the cache, read together"""
+        with self._lock:
+            count, newest = self._conn.execute('SELECT count(*), max(created_at) FROM geocode_cache').fetchone()
+        return count, hashlib.blake2b(f'{count}:{newest!r}'.encode('ascii'), digest_size=16).digest()
+
+    def fingerprint(self):
+        """16 bytes that change whenever an entry is added or replaced"""
+        return self.state()[1]
+
+    def export_snapshot(self, snapshot_path):
+        """Write every entry to a zstd-compressed Parquet file sorted by provider and address
+
+        Returns the number of entries written.
+        """
+        with self._lock:
+            # The table is clustered on its primary key, so this ORDER BY costs nothing
+            entries = pd.read_sql_query(
+                'SELECT provider, address, coordinates, created_at FROM geocode_cache ORDER BY provider, address',
+                self._conn)
+        entries['provider'] = entries['provider'].astype('category')
+        entries.to_parquet(snapshot_path, compression='zstd', index=False)
+        return len(entries)
+
+    def import_snapshot(self, snapshot_path):
+        """Merge a snapshot written by export_snapshot into this cache
+
+        An entry only replaces a local one when it is newer, so importing the
+        same snapshot again, or snapshots in any order, gives the same result.
+        Returns the number of entries added or updated.
+        """
+        entries = pd.read_parquet(snapshot_path, columns=['provider', 'address', 'coordinates', 'created_at'])
+        rows = zip(entries['provider'].astype(str), entries['address'], entries['coordinates'],
+                   entries['created_at'].astype(float))
+        with self._lock:
+            changes = self._conn.total_changes
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany('''
+                    INSERT INTO geocode_cache (provider, address, coordinates, created_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (provider, address) DO UPDATE
+                    SET coordinates = excluded.coordinates, created_at = excluded.created_at
+                    WHERE excluded.created_at > geocode_cache.created_at
+                ''', rows)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            return self._conn.total_changes - changes
+
+    def freeze(self, frozen_path):
+        """Write every entry to a FrozenCache file, returns the number of entries written"""
+        with self._lock:
+            rows = self._conn.execute('SELECT provider, address, coordinates, created_at FROM geocode_cache').fetchall()
+        entries = sorted(frozen_key(provider, address) + (coordinates.encode('utf-8'), created_at)
+                         for provider, address, coordinates, created_at in rows)
+
+        hashes = np.array([entry[0] for entry in entries], dtype=FROZEN_HASH)
+        index = bytearray(len(entries) * FROZEN_ENTRY.size)
+        offset = FROZEN_HEADER.size + hashes.nbytes + len(index)
+        for i, (_, key, value, created_at) in enumerate(entries):
+            FROZEN_ENTRY.pack_into(index, i * FROZEN_ENTRY.size, offset, len(key), offset + len(key), len(value),
+                                   created_at)
+            offset += len(key) + len(value)
+
+        # Build next to the target and swap it in, so readers never map a half-written file
+        temporary_path = frozen_path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(FROZEN_HEADER.pack(FROZEN_MAGIC, len(entries)))
+            f.write(hashes.tobytes())
+            f.write(index)
+            for _, key, value, _ in entries:
+                f.write(key)
+                f.write(value)
+        os.replace(temporary_path, frozen_path)
+        return len(entries)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class FrozenCache:
+    """Read-only snapshot of a GeocodeCache written by GeocodeCache.freeze
+
+    The file is memory-mapped and searched in place: the sorted key hashes
+    are viewed as a NumPy array without copying and binary searched, and only
+    the entry found is decoded. Opening a snapshot is instant, and concurrent
+    processes share it through the OS page cache instead of each loading a copy.
+
+    Args:
+        path: Snapshot file
+        ttl: Seconds after which an entry is ignored, None keeps every entry
+        negative_ttl: Same for negative entries
+    """
+
+    def __init__(self, path, ttl=None, negative_ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = FROZEN_HEADER.unpack_from(self._mm, 0)
+        if magic != FROZEN_MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not a frozen geocode cache")
+        self._hashes = np.frombuffer(self._mm, dtype=FROZEN_HASH, count=self.count, offset=FROZEN_HEADER.size)
+        self._index_offset = FROZEN_HEADER.size + self._hashes.nbytes
+
+    def _find(self, key_hash, key):
+        mm = self._mm
+        # Searching for a Python int above 2**63 would make NumPy convert the whole array
+        key_hash = np.uint64(key_hash)
+        i = int(np.searchsorted(self._hashes, key_hash))
+        # Entries with colliding hashes sit next to each other
+        while i < self.count and self._hashes[i] == key_hash:
+            key_offset, key_length, value_offset, value_length, created_at = FROZEN_ENTRY.unpack_from(
+                mm, self._index_offset + i * FROZEN_ENTRY.size)
+            if mm[key_offset:key_offset + key_length] == key:
+                return mm[value_offset:value_offset + value_length], created_at
+            i += 1
+        return None
+
+    def get(self, provider, address):
+        entry = self._find(*frozen_key(provider, address))
+        expired = False
+        if entry is not None:
+            value, created_at = entry
+            ttl = self.negative_ttl if value == b'[]' else self.ttl
+            expired = ttl is not None and time.time() - created_at > ttl
+        with self._lock:
+            if entry is None or expired:
+                self.misses += 1
+                self.evictions += expired
+                return None
+            self.hits += 1
+        return coordinates_to_features(json.loads(value))
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        # The hash view keeps the map exported, it has to go first
+        self._hashes = None
+        self._mm.close()
+
+
+class LRUCache:
+    """Thread-safe in-memory cache bounded by entry count and age
+
+    Args:
+        maxsize: Entries kept before the least recently used one is evicted, 0 disables the cache
+        ttl: Seconds an entry stays valid
+    """
+
+    def __init__(self, maxsize=DEFAULT_MEMORY_SIZE, ttl=DEFAULT_MEMORY_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if time.monotonic() > expires_at:
+                del self._entries[key]
+                self.misses += 1
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def load_bloom_filter(store, error_rate=0.01):
+    """Bloom filter of every key in a GeocodeCache, and the number of entries it covers
+
+    Reuses the filter saved next to the cache file by TieredCache.close when
+    the cache has not changed since, otherwise rebuilds it from the keys with
+    room for the cache to double in size.
+    """
+    entries, fingerprint = store.state()
+    bloom = BloomFilter.load(store.path + '.bloom', fingerprint)
+    if bloom is None:
+        keys = store.keys()
+        bloom = BloomFilter(max(2 * len(keys), 100_000), error_rate)
+        bloom.update(keys)
+    return bloom, entries
+
+
+class TieredCache:
+    """In-memory LRUCache in front of a persistent GeocodeCache
+
+    Reads try memory first, then the optional read-only FrozenCache, then the
+    store, and promote hits into memory; writes go to memory and the store.
+    With a Bloom filter of the store's keys, addresses it has never seen skip
+    the store query entirely. Offers the same get/put interface as GeocodeCache.
+
+    The filter is only saved for the next run when every key added to the
+    store since it was loaded came from this cache; keys another process
+    wrote in the meantime are not in it, so the saved copy is deleted instead.
+
+    Args:
+        store: GeocodeCache written through to
+        memory: LRUCache in front of it, a default-sized one if None
+        frozen: Optional FrozenCache read between the two
+        bloom: Filter of the store's keys from load_bloom_filter, or None
+        bloom_entries: Number of store entries the filter covered when loaded
+    """
+
+    def __init__(self, store, memory=None, frozen=None, bloom=None, bloom_entries=0):
+        self.store = store
+        self.memory = memory if memory is not None else LRUCache()
+        self.frozen = frozen
+        self.bloom = bloom
+        self.bloom_entries = bloom_entries
+        self.negative_hits = 0
+        self.bloom_skips = 0
+        self._bloom_added = 0
+        self._lock = threading.Lock()
+
+    def tiers(self):
+        """(name, cache) pairs from fastest to slowest, each with hits/misses/evictions counters"""
+        tiers = [('memory', self.memory), ('disk', self.store)]
+        if self.frozen is not None:
+            tiers.insert(1, ('frozen', self.frozen))
+        return tiers
+
+    def get(self, provider, address):
+        key = (provider, address)
+        data = self.memory.get(key)
+        if data is None:
+            if self.frozen is not None:
+                data = self.frozen.get(provider, address)
+            if data is None:
+                if self.bloom is None or encode_key(provider, address) in self.bloom:
+                    data = self.store.get(provider, address)
+                else:
+                    with self._lock:
+                        self.bloom_skips += 1
+            if data is not None:
+                self.memory.put(key, data)
+        if data is not None and not data['features']:
+            with self._lock:
+                self.negative_hits += 1
+        return data
+
+    def put(self, provider, address, data):
+        stored = bool(data['features']) or self.store.negative_ttl > 0
+        if stored:
+            self.memory.put((provider, address), data)
+        self.store.put(provider, address, data)
+        if stored and self.bloom is not None:
+            key = encode_key(provider, address)
+            with self._lock:
+                # A key the filter does not know is new to the store, one it might know is not counted
+                if key not in self.bloom:
+                    self.bloom.add(key)
+                    self._bloom_added += 1
+
+    def close(self):
+        if self.bloom is not None:
+            path = self.store.path + '.bloom'
+            entries, fingerprint = self.store.state()
+            if entries == self.bloom_entries + self._bloom_added:
+                # Tagged with the final state of the store, so the next run can skip the rebuild
+                self.bloom.save(path, fingerprint)
+            else:
+                # Another process added keys the filter never saw, the next run rebuilds it
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        self.store.close()
+        if self.frozen is not None:
+            self.frozen.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Share the geocode cache between machines')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH,
+                        help=f'SQLite cache file (default: {DEFAULT_CACHE_PATH})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='Dump the cache to a Parquet snapshot')
+    export_parser.add_argument('snapshot', help='Parquet file to write')
+    import_parser = subparsers.add_parser('import', help='Merge Parquet snapshots into the cache')
+    import_parser.add_argument('snapshot', nargs='+', help='Parquet file(s) written by export')
+    freeze_parser = subparsers.add_parser('freeze', help='Write a read-only memory-mapped snapshot for main.py --frozen-cache')
+    freeze_parser.add_argument('snapshot', help='Frozen snapshot file to write')
+    args = parser.parse_args()
+
+    geocode_cache = GeocodeCache(args.cache)
+    if args.command == 'export':
+        count = geocode_cache.export_snapshot(args.snapshot)
+        print(f"Exported {count} entries to {args.snapshot}")
+    elif args.command == 'freeze':
+        count = geocode_cache.freeze(args.snapshot)
+        print(f"Froze {count} entries into {args.snapshot}")
+    else:
+        for snapshot in args.snapshot:
+            count = geocode_cache.import_snapshot(snapshot)
+            print(f"Imported {snapshot}: {count} entries added or updated")
+    geocode_cache.close()
@@ -0,0 +1,429 @@
+import concurrent.futures
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from address import canonical_address
+from flow_control import TokenBucket, RetryPolicy, CircuitBreaker, SingleFlight
+
+API_BASE_URL = 'http://localhost:8080'
+
+# Proxy endpoint for each supported API
+ENDPOINTS = {
+    'google': '/external/geocode',
+    'geoapify': '/external/geocode-geoapify',
+}
+
+# Google statuses sent with a 200 that mean "try again later"
+GOOGLE_RETRYABLE_STATUSES = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30
+
+# Token buckets keyed by api_type, see set_rate_limit
+rate_limiters = {}
+
+# Circuit breakers keyed by api_type, see set_circuit_breaker
+circuit_breakers = {}
+
+# Optional flow_control.AdaptiveLimiter shared by every request to the proxy
+concurrency_limiter = None
+
+# Retry policy applied to every lookup, see set_retry_policy
+retry_policy = RetryPolicy()
+
+# Seconds to wait for the proxy before treating a request as failed
+request_timeout = DEFAULT_TIMEOUT
+
+# Optional flow_control.HedgePolicy and the threads running hedged attempts
+hedge_policy = None
+_hedge_executor = None
+
+# Coalesces concurrent lookups of the same address into one request
+coalescer = SingleFlight()
+
+# Optional geocode_cache.GeocodeCache consulted before the network, see set_cache
+cache = None
+cache_reads = True
+
+# Shared session reused by every worker thread (see configure_session)
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, max_hosts=4):
+    """Create a keep-alive session backed by a bounded connection pool
+
+    Args:
+        pool_size: Maximum open connections kept per host, usually the worker count
+        max_hosts: Number of per-host pools to keep around
+    """
+    session = requests.Session()
+    # pool_block makes workers wait for a free connection instead of opening
+    # throwaway ones past the limit, which is what exhausts ephemeral ports
+    adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=pool_size, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def configure_session(pool_size=DEFAULT_POOL_SIZE):
+    """Replace the shared session with one sized for pool_size concurrent workers"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = create_session(pool_size)
+    return _session
+
+
+def get_session():
+    """Return the shared session, creating it with the default pool size if needed"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def set_rate_limit(api_type, rate, burst=None):
+    """Limit requests to api_type to `rate` per second with bursts of up to `burst`"""
+    rate_limiters[api_type.lower()] = TokenBucket(rate, burst)
+
+
+def get_rate_limiter(api_type):
+    """Return the TokenBucket for api_type, or None if it is not rate limited"""
+    return rate_limiters.get(api_type.lower())
+
+
+def set_request_timeout(seconds):
+    global request_timeout
+    request_timeout = seconds
+
+
+def get_request_timeout():
+    return request_timeout
+
+
+def set_circuit_breaker(api_type, failure_threshold=5, reset_timeout=30.0, fail_fast=False):
+    """Trip requests to api_type after failure_threshold consecutive transient failures"""
+    circuit_breakers[api_type.lower()] = CircuitBreaker(api_type.lower(), failure_threshold, reset_timeout,
+                                                        fail_fast=fail_fast)
+
+
+def get_circuit_breaker(api_type):
+    """Return the CircuitBreaker for api_type, or None if it has none"""
+    return circuit_breakers.get(api_type.lower())
+
+
+def set_retry_policy(policy):
+    global retry_policy
+    retry_policy = policy
+
+
+def get_retry_policy():
+    return retry_policy
+
+
+def set_hedge_policy(policy, workers=DEFAULT_POOL_SIZE):
+    """Race a backup request against attempts slower than the policy allows, or pass None to disable
+
+    Hedged attempts run on their own threads, two for each of `workers` callers.
+    """
+    global hedge_policy, _hedge_executor
+    if _hedge_executor is not None:
+        _hedge_executor.shutdown(wait=False)
+    hedge_policy = policy
+    _hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2 * workers) if policy is not None else None
+
+
+def get_hedge_policy():
+    return hedge_policy
+
+
+def set_cache(geocode_cache, refresh=False):
+    """Serve lookups from geocode_cache and store new results in it, or pass None to disable
+
+    With refresh the cache is only written to, so every address is fetched again.
+    """
+    global cache, cache_reads
+    cache = geocode_cache
+    cache_reads = not refresh
+
+
+def get_cache():
+    return cache
+
+
+def cached_geocode(key):
+    """Return the cached response for an address_key, or None"""
+    if cache is None or not cache_reads:
+        return None
+    return cache.get(*key)
+
+
+def store_geocode(key, data):
+    """Remember the answer the provider gave for an address_key
+
+    A feature-less answer means the provider found nothing, it is stored as
+    a negative entry. Failed lookups must not be stored at all.
+    """
+    if cache is not None:
+        cache.put(*key, data)
+
+
+def get_coalescer():
+    return coalescer
+
+
+def set_concurrency_limiter(limiter):
+    """Gate every request through an AdaptiveLimiter, or pass None to disable"""
+    global concurrency_limiter
+    concurrency_limiter = limiter
+
+
+def get_concurrency_limiter():
+    return concurrency_limiter
+
+
+def is_overload_status(status_code):
+    """Whether an HTTP status means the proxy or its provider is overloaded"""
+    return status_code == 429 or status_code >= 500
+
+
+def parse_retry_after(value):
+    """Convert a Retry-After header (seconds or HTTP date) to seconds, or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class GeocodeRequestError(Exception):
+    """A single request to the proxy failed
+
+    retryable tells whether the same request may succeed later (timeouts,
+    connection errors, 5xx, 429) as opposed to a permanent 4xx rejection.
+    """
+
+    def __init__(self, message, status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def status_error(status_code, retry_after_header=None):
+    """Build the GeocodeRequestError for a non-200 response"""
+    return GeocodeRequestError(f"HTTP {status_code}", status=status_code,
+                               retryable=retry_policy.is_retryable_status(status_code),
+                               retry_after=parse_retry_after(retry_after_header))
+
+
+def address_key(endereco, api_type='geoapify'):
+    """Key identifying lookups that are bound to return the same result"""
+    return api_type.lower(), canonical_address(endereco)
+
+
+def geocode_url(api_type):
+    """Return the proxy URL for api_type, defaulting to geoapify"""
+    endpoint = ENDPOINTS['google'] if api_type.lower() == 'google' else ENDPOINTS['geoapify']
+    return API_BASE_URL + endpoint
+
+
+def normalize_google_response(data):
+    """Convert Google API response format to match Geoapify format"""
+    if not data or 'results' not in data or not data['results']:
+        return None
+
+    normalized_data = {
+        'features': []
+    }
+
+    for result in data['results']:
+        if 'geometry' in result and 'location' in result['geometry']:
+            location = result['geometry']['location']
+            feature = {
+                'geometry': {
+                    'coordinates': [location['lng'], location['lat']]
+                }
+            }
+            normalized_data['features'].append(feature)
+
+    return normalized_data
+
+
+def parse_geocode_response(data, api_type):
+    """Normalize a decoded API response to the Geoapify format
+
+    Only a definite "nothing found" (Google ZERO_RESULTS, or an empty
+    Geoapify feature list) gives a response without features. Error bodies
+    sent with a 200 raise GeocodeRequestError, so they are never cached.
+    """
+    if not isinstance(data, dict):
+        raise GeocodeRequestError(f"unexpected {api_type} response")
+    if api_type.lower() == 'google':
+        status = data.get('status')
+        if status == 'ZERO_RESULTS':
+            return {'features': []}
+        normalized = normalize_google_response(data)
+        if status not in (None, 'OK') or normalized is None:
+            raise GeocodeRequestError(f"Google status {status}", retryable=status in GOOGLE_RETRYABLE_STATUSES)
+        return normalized
+    if not isinstance(data.get('features'), list):
+        raise GeocodeRequestError(f"unexpected {api_type} response")
+    return data
+
+
+def _get(endereco, api_type):
+    """GET the proxy, reporting the outcome to the adaptive concurrency limiter"""
+    limiter = concurrency_limiter
+    if limiter is None:
+        return get_session().get(geocode_url(api_type), params={'address': endereco}, timeout=request_timeout)
+
+    limiter.acquire()
+    start = time.monotonic()
+    overloaded = True
+    try:
+        response = get_session().get(geocode_url(api_type), params={'address': endereco}, timeout=request_timeout)
+        overloaded = is_overload_status(response.status_code)
+        return response
+    finally:
+        limiter.release(time.monotonic() - start, overloaded)
+
+
+def _request(endereco, api_type):
+    """Send one request and return the normalized response
+
+    Raises GeocodeRequestError when the proxy cannot be reached or answers with
+    anything but 200.
+    """
+    try:
+        response = _get(endereco, api_type)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise GeocodeRequestError(str(e), retryable=True) from e
+    if response.status_code != 200:
+        raise status_error(response.status_code, response.headers.get('Retry-After'))
+    # Normalize Google response to match Geoapify format
+    return parse_geocode_response(response.json(), api_type)
+
+
+def _timed_request(endereco, api_type, policy):
+    start = time.monotonic()
+    data = _request(endereco, api_type)
+    policy.record(time.monotonic() - start)
+    return data
+
+
+def _hedged_request(endereco, api_type):
+    """Run one attempt, racing a backup request against it when it is slower than usual"""
+    policy = hedge_policy
+    if policy is None:
+        return _request(endereco, api_type)
+    delay = policy.delay()
+    if delay is None:
+        return _timed_request(endereco, api_type, policy)
+
+    primary = _hedge_executor.submit(_timed_request, endereco, api_type, policy)
+    try:
+        return primary.result(timeout=delay)
+    except concurrent.futures.TimeoutError:
+        pass
+    # Never let a hedge wait for quota, the primary request is still running
+    limiter = get_rate_limiter(api_type)
+    if not policy.try_hedge() or (limiter is not None and not limiter.try_acquire()):
+        return primary.result()
+
+    backup = _hedge_executor.submit(_timed_request, endereco, api_type, policy)
+    error = None
+    for future in concurrent.futures.as_completed([primary, backup]):
+        try:
+            return future.result()
+        except GeocodeRequestError as e:
+            error = e
+    raise error
+
+
+def fetch_geocode(endereco, api_type='geoapify'):
+    """Fetch geocode data from specified API
+
+    Transient failures are retried according to the configured RetryPolicy,
+    and slow attempts are hedged when a HedgePolicy is set.
+    While the provider's circuit is open the lookup waits for it to recover,
+    or gives up straight away if the breaker is set to fail fast.
+    Concurrent lookups of the same address share a single request, and
+    addresses found in the cache skip the network altogether.
+    Returns None when the address could not be geocoded.
+
+    Args:
+        endereco: Address to geocode
+        api_type: 'geoapify' or 'google'
+    """
+    key = address_key(endereco, api_type)
+    data = cached_geocode(key)
+    if data is not None:
+        return data
+    return coalescer.do(key, _fetch_and_store, key, endereco, api_type)
+
+
+def _fetch_and_store(key, endereco, api_type):
+    try:
+        data = _fetch_geocode(endereco, api_type)
+    except GeocodeRequestError:
+        return None
+    store_geocode(key, data)
+    return data
+
+
+def _fetch_geocode(endereco, api_type):
+    """Fetch the provider's answer for endereco, raising GeocodeRequestError if it could not be obtained"""
+    limiter = get_rate_limiter(api_type)
+    breaker = get_circuit_breaker(api_type)
+    policy = retry_policy
+    attempt = 1
+    while True:
+        if breaker is not None:
+            wait = breaker.before_request()
+            if wait > 0:
+                if breaker.fail_fast:
+                    raise GeocodeRequestError(f"circuit for {api_type} is open", retryable=True)
+                time.sleep(wait)
+                continue
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            data = _hedged_request(endereco, api_type)
+        except GeocodeRequestError as e:
+            if breaker is not None:
+                breaker.record(healthy=not e.retryable)
+            if not e.retryable:
+                raise
+            if attempt >= policy.max_attempts:
+                print(f"Error fetching geocode for {endereco}: {e} (gave up after {attempt} attempts)")
+                raise
+            time.sleep(policy.delay(attempt, e.retry_after))
+            attempt += 1
+        except Exception as e:
+            if breaker is not None:
+                breaker.record(healthy=True)
+            print(f"Error fetching geocode for {endereco}: {e}")
+            raise GeocodeRequestError(str(e)) from e
+        else:
+            if breaker is not None:
+                breaker.record(healthy=True)
+            return data
@@ -0,0 +1,72 @@
+import binascii
+import numpy as np
+import pandas as pd
+
+GEOMETRY_FORMATS = ['wkt', 'wkb', 'ewkb', 'xy']
+
+WKB_POINT = 1
+EWKB_SRID_FLAG = 0x20000000
+# Little-endian (NDR) point records as PostGIS writes them, without and with an SRID
+WKB_POINT_RECORD = np.dtype([('byte_order', 'u1'), ('type', '<u4'), ('x', '<f8'), ('y', '<f8')])
+EWKB_POINT_RECORD = np.dtype([('byte_order', 'u1'), ('type', '<u4'), ('srid', '<u4'), ('x', '<f8'), ('y', '<f8')])
+
+# POINT(x y), optionally with an EWKT "SRID=n;" prefix
+_WKT_POINT = r'^(?:SRID=(\d+);)?\s*POINT\s*\(\s*([^\s)]+)\s+([^\s)]+)\s*\)$'
+_HEX = r'[0-9A-Fa-f]+'
+
+
+def points_to_wkt(x, y):
+    """WKT POINT strings for arrays of coordinates, formatted like f'POINT({x} {y})'"""
+    return 'POINT(' + x.astype(str).astype(object) + ' ' + y.astype(str).astype(object) + ')'
+
+
+def points_to_wkb(x, y, srid=None):
+    """Hex WKB point for arrays of coordinates, or EWKB when srid (one code or one per point) is given
+
+    The records are laid out in one structured array and hex encoded in a
+    single call, then split into one string per point.
+    """
+    record = WKB_POINT_RECORD if srid is None else EWKB_POINT_RECORD
+    records = np.empty(len(x), dtype=record)
+    records['byte_order'] = 1
+    if srid is None:
+        records['type'] = WKB_POINT
+    else:
+        records['type'] = WKB_POINT | EWKB_SRID_FLAG
+        records['srid'] = srid
+    records['x'] = x
+    records['y'] = y
+    width = 2 * record.itemsize
+    encoded = binascii.hexlify(records.tobytes()).upper()
+    return np.frombuffer(encoded, dtype=f'S{width}').astype(f'U{width}').astype(object)
+
+
+def parse_points(geoms):
+    """Coordinates of each point in a Series of WKT/EWKT POINT or hex (E)WKB strings
+
+    Returns x, y and srid arrays; x and y are NaN where a value is missing or
+    not a point, srid is 0 where the value does not carry one.
+    """
+    text = geoms.astype(object).where(geoms.notna(), '').astype(str).str.strip()
+    x = np.full(len(text), np.nan)
+    y = np.full(len(text), np.nan)
+    srid = np.zeros(len(text), dtype=np.int64)
+
+    wkt = text.str.extract(_WKT_POINT)
+    x[:] = pd.to_numeric(wkt[1], errors='coerce')
+    y[:] = pd.to_numeric(wkt[2], errors='coerce')
+    srid[:] = pd.to_numeric(wkt[0], errors='coerce').fillna(0)
+
+    hexadecimal = text.str.fullmatch(_HEX) & text.str.startswith('01')
+    for record, point_type in ((WKB_POINT_RECORD, WKB_POINT), (EWKB_POINT_RECORD, WKB_POINT | EWKB_SRID_FLAG)):
+        selected = (hexadecimal & (text.str.len() == 2 * record.itemsize)).to_numpy()
+        if not selected.any():
+            continue
+        records = np.frombuffer(binascii.unhexlify(''.join(text[selected])), dtype=record)
+        points = records['type'] == point_type
+        positions = np.flatnonzero(selected)[points]
+        x[positions] = records['x'][points]
+        y[positions] = records['y'][points]
+        if 'srid' in record.names:
+            srid[positions] = records['srid'][points]
+    return x, y, srid
@@ -1,129 +1,378 @@
+import numpy as np
 import pandas as pd
 import os
-import pyproj
-import requests
 import concurrent.futures
 import argparse
 from tqdm import tqdm
+from pyproj import CRS
+from pyproj.exceptions import CRSError
+from address import canonicalize_addresses, select_queries
+from checkpoint import CheckpointJournal, DEFAULT_FLUSH_INTERVAL
+from flow_control import AdaptiveLimiter, RetryPolicy, HedgePolicy, submit_bounded
+from geocode_cache import (GeocodeCache, FrozenCache, LRUCache, TieredCache, load_bloom_filter, features_to_coordinates,
+                           DEFAULT_CACHE_PATH, DEFAULT_MEMORY_SIZE)
+from geocode_client import (fetch_geocode, configure_session, close_session, set_rate_limit, set_concurrency_limiter,
+                            set_retry_policy, set_request_timeout, set_circuit_breaker, set_hedge_policy, get_coalescer,
+                            set_cache)
+from geometry import points_to_wkt, points_to_wkb, parse_points, GEOMETRY_FORMATS
+from projection import project, project_utm, get_transformer, WGS84
 
-# Create a single transformer object to be reused
-transformer = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:31982", always_xy=True)
-
-def convert_lat_lon_to_UTM(lat, lon):
-    utm_x, utm_y = transformer.transform(lon, lat)
-    UTM = f'POINT({utm_x} {utm_y})'
-    return UTM
-
-def duplicate_row_with_new_UTM(row, coordinates):
-    new_row = row._asdict()
-    new_row['the_geom'] = convert_lat_lon_to_UTM(coordinates[1], coordinates[0])
-    return new_row
-
-def normalize_google_response(data):
-    """Convert Google API response format to match Geoapify format"""
-    if not data or 'results' not in data or not data['results']:
-        return None
-
-    normalized_data = {
-        'features': []
-    }
-
-    for result in data['results']:
-        if 'geometry' in result and 'location' in result['geometry']:
-            location = result['geometry']['location']
-            feature = {
-                'geometry': {
-                    'coordinates': [location['lng'], location['lat']]
-                }
-            }
-            normalized_data['features'].append(feature)
-
-    return normalized_data
-
-def fetch_geocode(endereco, api_type='geoapify'):
-    """Fetch geocode data from specified API
-
-    Args:
-        endereco: Address to geocode
-        api_type: 'geoapify' or 'google'
+def project_points(lon, lat):
+    """Project arrays of WGS84 longitudes and latitudes to --target-crs
+
+    Returns x, y and, with --target-crs auto, the EPSG code of the zone each
+    point was projected to, otherwise None.
     """
-    try:
-        if api_type.lower() == 'google':
-            url = f'http://localhost:8080/external/geocode?address={endereco}'
-        else:  # default to geoapify
-            url = f'http://localhost:8080/external/geocode-geoapify?address={endereco}'
-
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            # Normalize Google response to match Geoapify format
-            if api_type.lower() == 'google':
-                return normalize_google_response(data)
-            return data
-        return None
-    except Exception as e:
-        print(f"Error fetching geocode for {endereco}: {e}")
-        return None
+    if args.target_crs == 'auto':
+        return project_utm(lon, lat)
+    x, y = project(lon, lat, args.target_crs)
+    return x, y, None
+
+def geometry_columns(x, y, srids):
+    """Output columns for arrays of projected points in --geometry-format, {column: values}"""
+    if args.geometry_format == 'xy':
+        return {'x': x, 'y': y}
+    if args.geometry_format == 'wkb':
+        return {'the_geom': points_to_wkb(x, y)}
+    if args.geometry_format == 'ewkb':
+        return {'the_geom': points_to_wkb(x, y, srids if srids is not None else target_srid)}
+    return {'the_geom': points_to_wkt(x, y)}
+
+def convert_input_geometries(df):
+    """Bring the points already in df to --geometry-format, so every row uses the same one"""
+    if args.geometry_format == 'xy' and 'x' not in df.columns:
+        # Points already in the input move over to x/y, so the_geom is left with only what is not a point
+        df['x'], df['y'], _ = parse_points(df['the_geom'])
+        df.loc[df['x'].notna().to_numpy() & df['y'].notna().to_numpy(), 'the_geom'] = None
+    elif args.geometry_format in ('wkb', 'ewkb'):
+        present = np.flatnonzero(df['the_geom'].notna().to_numpy())
+        x, y, srids = parse_points(df['the_geom'].iloc[present])
+        parsed = np.isfinite(x) & np.isfinite(y)
+        if not parsed.all():
+            print(f"Left {np.count_nonzero(~parsed)} the_geom values that are not points as they were")
+        if not parsed.any():
+            return
+        x, y, srids = x[parsed], y[parsed], srids[parsed]
+        if args.geometry_format == 'wkb':
+            encoded = points_to_wkb(x, y)
+        else:
+            # EWKB input keeps its own SRID, anything else is taken to be in the target CRS
+            encoded = points_to_wkb(x, y, np.where(srids > 0, srids, target_srid))
+        df.iloc[present[parsed], df.columns.get_loc('the_geom')] = encoded
 
 # Set up argument parser
 parser = argparse.ArgumentParser(description='Geocode addresses using different APIs')
 parser.add_argument('--api', choices=['geoapify', 'google'], default='geoapify',
                     help='API to use for geocoding (default: geoapify)')
-parser.add_argument('--input', default='input/Honório_Serpa_teste_api_pontos.csv',
-                    help='Input CSV file path (default: input/Honório_Serpa_teste_api_pontos.csv)')
+parser.add_argument('--input', nargs='+', default=['input/Honório_Serpa_teste_api_pontos.csv'],
+                    help='Input CSV file path(s), geocoded one after the other sharing the same caches '
+                         '(default: input/Honório_Serpa_teste_api_pontos.csv)')
+parser.add_argument('--chunk-size', type=int, default=None,
+                    help='Read, geocode and write input files this many rows at a time, for files that do not '
+                         'fit in memory (default: whole file at once)')
+parser.add_argument('--resume', action='store_true',
+                    help='Continue an interrupted run, reusing the rows recorded in its checkpoint journal')
+parser.add_argument('--checkpoint-interval', type=float, default=DEFAULT_FLUSH_INTERVAL,
+                    help=f'Seconds between checkpoint journal flushes, 0 flushes every row '
+                         f'(default: {DEFAULT_FLUSH_INTERVAL:g})')
+parser.add_argument('--workers', type=int, default=10,
+                    help='Number of concurrent geocoding workers (default: 10)')
+parser.add_argument('--pool-size', type=int, default=None,
+                    help='Keep-alive connections kept open to the proxy (default: same as --workers)')
+parser.add_argument('--engine', choices=['thread', 'async'], default='thread',
+                    help='Run lookups on a thread pool or from a single asyncio event loop (default: thread)')
+parser.add_argument('--window', type=int, default=None,
+                    help='Lookups queued on the thread pool at any time (default: 4 x the thread pool size)')
+parser.add_argument('--concurrency', type=int, default=100,
+                    help='Maximum in-flight requests for the async engine (default: 100)')
+parser.add_argument('--rate', type=float, default=None,
+                    help='Maximum requests per second sent to the selected API (default: unlimited)')
+parser.add_argument('--burst', type=int, default=None,
+                    help='Requests allowed back to back before --rate applies (default: one second of --rate)')
+parser.add_argument('--adaptive', action='store_true',
+                    help='Adapt in-flight requests to proxy health, starting at --workers and growing up to '
+                         '--max-workers (thread engine) or --concurrency (async engine)')
+parser.add_argument('--max-workers', type=int, default=64,
+                    help='Thread pool size when --adaptive is set (default: 64)')
+parser.add_argument('--max-attempts', type=int, default=4,
+                    help='Attempts per address before giving up on timeouts, 5xx and 429 (default: 4, 1 disables retries)')
+parser.add_argument('--retry-delay', type=float, default=0.5,
+                    help='Initial retry backoff in seconds, doubled on every retry (default: 0.5)')
+parser.add_argument('--timeout', type=float, default=30,
+                    help='Seconds to wait for the proxy before retrying a request (default: 30)')
+parser.add_argument('--breaker-threshold', type=int, default=5,
+                    help='Consecutive failures that open the circuit to the API (default: 5, 0 disables)')
+parser.add_argument('--breaker-cooldown', type=float, default=30,
+                    help='Seconds the circuit stays open before a probe request (default: 30)')
+parser.add_argument('--breaker-fail-fast', action='store_true',
+                    help='Skip addresses while the circuit is open instead of waiting for the API to recover')
+parser.add_argument('--hedge', action='store_true',
+                    help='Send a backup request when a lookup is slower than --hedge-percentile of recent lookups')
+parser.add_argument('--hedge-percentile', type=float, default=95,
+                    help='Latency percentile after which a lookup is hedged (default: 95)')
+parser.add_argument('--hedge-max-ratio', type=float, default=0.05,
+                    help='Maximum share of lookups that may be hedged (default: 0.05)')
+parser.add_argument('--target-crs', default='EPSG:31982',
+                    help='CRS the_geom is written in, or "auto" to use the SIRGAS 2000 UTM zone of each point '
+                         'and record its EPSG code in an srid column (default: EPSG:31982, UTM zone 22S)')
+parser.add_argument('--geometry-format', choices=GEOMETRY_FORMATS, default='wkt',
+                    help='Write the_geom as WKT POINT text, hex WKB, hex EWKB carrying the SRID, or write numeric '
+                         'x and y columns instead, leaving in the_geom only input values that are not points '
+                         '(default: wkt)')
+parser.add_argument('--cache', default=DEFAULT_CACHE_PATH,
+                    help=f'SQLite file caching geocode results between runs (default: {DEFAULT_CACHE_PATH})')
+parser.add_argument('--cache-ttl', type=float, default=90,
+                    help='Days before a cached result is fetched again (default: 90)')
+parser.add_argument('--negative-cache-ttl', type=float, default=7,
+                    help='Days before an address the API found nothing for is tried again (default: 7, 0 disables)')
+parser.add_argument('--frozen-cache', default=None,
+                    help='Read-only snapshot from "geocode_cache.py freeze", checked before the cache file')
+parser.add_argument('--memory-cache-size', type=int, default=DEFAULT_MEMORY_SIZE,
+                    help=f'Results kept in memory in front of the cache file (default: {DEFAULT_MEMORY_SIZE}, 0 disables)')
+parser.add_argument('--memory-cache-ttl', type=float, default=3600,
+                    help='Seconds a result stays in the in-memory cache (default: 3600)')
+parser.add_argument('--no-bloom', action='store_true',
+                    help='Query the cache file for every address instead of skipping the ones it never had')
+parser.add_argument('--no-cache', action='store_true',
+                    help='Neither read nor write the geocode cache')
+parser.add_argument('--refresh', action='store_true',
+                    help='Ignore cached results but store the fresh ones')
 args = parser.parse_args()
 
-# Get input filename and API type from arguments
-input_filename = args.input
+# Get API type from arguments
 api_type = args.api
 
 print(f"Using {api_type} API for geocoding")
-df = pd.read_csv(input_filename, sep=';')
-
-# Prepare data for processing
-rows_to_process = []
-for row_idx, row in enumerate(df.itertuples()):
-    if pd.isna(row.the_geom):
-        endereco = row.endereco.replace('-', '').replace('P/', '') + ' PARANA'
-        rows_to_process.append((row_idx, row, endereco))
-
-# Process data in parallel
-new_rows = []
-updates = {}
-
-print(f"Processing {len(rows_to_process)} addresses using {api_type} API...")
-with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-    # Map the fetch_geocode function to all addresses with the selected API type
-    future_to_row = {executor.submit(fetch_geocode, row[2], api_type): row for row in rows_to_process}
-
-    # Process results as they complete
-    for future in tqdm(concurrent.futures.as_completed(future_to_row), total=len(rows_to_process)):
-        row_idx, row, endereco = future_to_row[future]
+if args.target_crs != 'auto':
+    try:
+        get_transformer(WGS84, args.target_crs)
+    except CRSError as e:
+        parser.error(f"invalid --target-crs {args.target_crs}: {e}")
+target_srid = None
+if args.geometry_format == 'ewkb':
+    # With auto, points already in the input files are taken to be in UTM 22S, as they always have been
+    target_srid = CRS.from_user_input(args.target_crs if args.target_crs != 'auto' else 'EPSG:31982').to_epsg()
+    if target_srid is None:
+        parser.error(f"--geometry-format ewkb needs a --target-crs with an EPSG code, got {args.target_crs}")
+set_retry_policy(RetryPolicy(max_attempts=args.max_attempts, base_delay=args.retry_delay))
+set_request_timeout(args.timeout)
+if args.breaker_threshold > 0:
+    set_circuit_breaker(api_type, args.breaker_threshold, args.breaker_cooldown, fail_fast=args.breaker_fail_fast)
+if args.rate:
+    set_rate_limit(api_type, args.rate, args.burst)
+    print(f"Rate limited to {args.rate:g} requests/s")
+thread_count = args.max_workers if args.adaptive else args.workers
+limiter = None
+if args.adaptive:
+    max_limit = thread_count if args.engine == 'thread' else args.concurrency
+    limiter = AdaptiveLimiter(initial=args.workers, max_limit=max_limit)
+    set_concurrency_limiter(limiter)
+    print(f"Adaptive concurrency: starting at {limiter.current_limit}, up to {max_limit} in-flight requests")
+geocode_cache = None
+if not args.no_cache:
+    ttl = args.cache_ttl * 24 * 3600
+    negative_ttl = args.negative_cache_ttl * 24 * 3600
+    frozen_cache = None
+    if args.frozen_cache:
+        frozen_cache = FrozenCache(args.frozen_cache, ttl=ttl, negative_ttl=negative_ttl)
+    store = GeocodeCache(args.cache, ttl=ttl, negative_ttl=negative_ttl)
+    bloom, bloom_entries = (None, 0) if args.no_bloom else load_bloom_filter(store)
+    geocode_cache = TieredCache(store, LRUCache(args.memory_cache_size, ttl=args.memory_cache_ttl), frozen_cache,
+                                bloom, bloom_entries)
+    set_cache(geocode_cache, refresh=args.refresh)
+hedging = None
+if args.hedge:
+    hedging = HedgePolicy(percentile=args.hedge_percentile, max_ratio=args.hedge_max_ratio)
+    set_hedge_policy(hedging, workers=thread_count)
+if args.engine == 'thread':
+    # Share one pooled keep-alive session between all workers, with room for their hedges
+    configure_session((args.pool_size or thread_count) * (2 if hedging else 1))
+
+
+def geocode_frame(df, desc=None, journal=None, done=None, first_row=0):
+    """Geocode the rows of df missing the_geom, returns df with the results and a row per extra feature
+
+    Rows are numbered from first_row, their position in the input file. Each
+    finished row is recorded in journal, and rows found in done, the result
+    of an earlier run read back from a journal, are filled in without a lookup.
+    """
+    # [lng, lat] of every point found and the row it belongs to, projected together at the end
+    point_rows = []
+    point_coordinates = []
+
+    def add_points(row_idx, coordinates):
+        point_rows.extend([row_idx] * len(coordinates))
+        point_coordinates.extend(coordinates)
+
+    # Select the rows to geocode and build their queries with whole-column operations
+    done = done or {}
+    rows_to_process, queries = select_queries(df)
+    if done:
+        resumed = np.isin(rows_to_process + first_row, np.fromiter(done, dtype=np.int64, count=len(done)))
+        for row_idx in rows_to_process[resumed].tolist():
+            add_points(row_idx, done[first_row + row_idx])
+        rows_to_process = rows_to_process[~resumed]
+        queries = queries[~resumed]
+
+    # Geocode each distinct address once, its result is shared by every row whose
+    # address has the same canonical form and sent under the first spelling seen
+    address_keys = canonicalize_addresses(queries).to_numpy()
+    queries = queries.to_numpy()
+    groups = pd.Series(rows_to_process).groupby(address_keys, sort=False).indices
+    rows_by_address = {queries[group[0]]: rows_to_process[group].tolist() for group in groups.values()}
+    del queries, address_keys, groups
+
+    def collect_result(endereco, data):
+        """Apply one lookup result to every row sharing the address"""
+        # A failed lookup is left out of the journal, so a resumed run tries it again
+        if data is None:
+            return
         try:
-            data = future.result()
-            if data:
-                for i, feature in enumerate(data.get('features', [])):
-                    coordinates = feature.get('geometry').get('coordinates')
-                    if i == 0:
-                        updates[row_idx] = convert_lat_lon_to_UTM(coordinates[1], coordinates[0])
-                    else:
-                        new_rows.append(duplicate_row_with_new_UTM(row, coordinates))
+            coordinates = [[float(lon), float(lat)] for lon, lat in features_to_coordinates(data)]
         except Exception as e:
             print(f"Error processing {endereco}: {e}")
+            return
+        for row_idx in rows_by_address[endereco]:
+            add_points(row_idx, coordinates)
+            if journal is not None:
+                journal.record(first_row + row_idx, coordinates)
 
-# Apply updates to the dataframe
-for row_idx, utm in updates.items():
-    df.at[row_idx, 'the_geom'] = utm
+    # Process data in parallel
+    print(f"Processing {len(rows_to_process)} rows ({len(rows_by_address)} distinct addresses) using {api_type} API...")
+    with tqdm(total=len(rows_by_address), desc=desc) as progress:
+        def on_result(endereco, data):
+            collect_result(endereco, data)
+            if limiter is not None:
+                progress.set_postfix(limit=limiter.current_limit, refresh=False)
+            progress.update(1)
+
+        if args.engine == 'async':
+            from async_engine import geocode_all
+
+            geocode_all(iter(rows_by_address), api_type, on_result, concurrency=args.concurrency)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
+                # Addresses are submitted as earlier lookups finish, keeping the number of
+                # pending futures flat whatever the size of the input
+                window = args.window or 4 * thread_count
+                for endereco, future in submit_bounded(executor, fetch_geocode, iter(rows_by_address), window,
+                                                       api_type):
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        print(f"Error processing {endereco}: {e}")
+                        data = None
+                    on_result(endereco, data)
+
+    if len(rows_to_process):
+        duplicates = len(rows_to_process) - len(rows_by_address)
+        print(f"Deduplicated {duplicates} of {len(rows_to_process)} rows "
+              f"({duplicates / len(rows_to_process):.1%}), {len(rows_by_address)} lookups dispatched")
+
+    if args.target_crs == 'auto' and 'srid' not in df.columns:
+        df['srid'] = pd.Series(pd.NA, index=df.index, dtype='Int64')
+    convert_input_geometries(df)
+    if not point_rows:
+        return df
+
+    # Project every point in one batch, per zone in auto mode
+    rows = np.array(point_rows)
+    lon, lat = np.array(point_coordinates, dtype=float).T
+    x, y, srids = project_points(lon, lat)
+    valid = np.isfinite(x) & np.isfinite(y)
+    if not valid.all():
+        print(f"Dropped {np.count_nonzero(~valid)} points that cannot be projected to {args.target_crs}")
+        rows, x, y = rows[valid], x[valid], y[valid]
+        if srids is not None:
+            srids = srids[valid]
+        if not len(rows):
+            return df
+    columns = geometry_columns(x, y, srids)
+    if srids is not None:
+        columns['srid'] = srids
+
+    # The first point of a row fills its geometry, each further one becomes a new row; points
+    # of a row are contiguous. Rows are positions, so chunks of a larger file work too
+    first = np.r_[True, rows[1:] != rows[:-1]]
+    for column, values in columns.items():
+        df.iloc[rows[first], df.columns.get_loc(column)] = values[first]
+
+    # The other points become copies of their source row, taken in one go with their
+    # geometry columns assigned as whole arrays
+    extra = ~first
+    if extra.any():
+        new_rows = df.take(rows[extra])
+        for column, values in columns.items():
+            new_rows[column] = values[extra]
+        # Extra rows have always carried the Index of their source row
+        new_rows['Index'] = df.index.take(rows[extra])
+        df = pd.concat([df, new_rows], ignore_index=True)
+    return df
+
+
+def geocode_file(input_filename):
+    """Geocode the rows of input_filename missing the_geom and write the result to output/"""
+    output_dir = 'output'
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    input_filepath = os.path.basename(input_filename + f'-{api_type}.csv')
+    output_path = os.path.join(output_dir, input_filepath)
+    # Read both as text even when a whole chunk has no value in them
+    dtype = {'endereco': str, 'the_geom': str}
+
+    # Rows finished by an interrupted run are taken from its journal, the output is written again in full
+    journal_path = output_path + '.journal'
+    done = {}
+    if args.resume:
+        done = CheckpointJournal.load(journal_path)
+        if done:
+            print(f"Resuming {input_filename}: {len(done)} rows already geocoded")
+    elif os.path.exists(journal_path):
+        os.remove(journal_path)
+    journal = CheckpointJournal(journal_path, flush_interval=args.checkpoint_interval)
+
+    try:
+        if not args.chunk_size:
+            df = geocode_frame(pd.read_csv(input_filename, sep=';', dtype=dtype), journal=journal, done=done)
+            df.to_csv(output_path, sep=';', index=False)
+        else:
+            # Stream the file, each chunk is geocoded and appended to the output before the next one is read
+            columns = None
+            first_row = 0
+            for chunk_number, chunk in enumerate(pd.read_csv(input_filename, sep=';', dtype=dtype,
+                                                             chunksize=args.chunk_size)):
+                df = geocode_frame(chunk, desc=f'Chunk {chunk_number + 1}', journal=journal, done=done,
+                                   first_row=first_row)
+                if columns is None:
+                    # Rows added for extra features carry the Index of their source row, keep the
+                    # header the same for every chunk whether or not it has any
+                    columns = [column for column in df.columns if column != 'Index'] + ['Index']
+                df = df.reindex(columns=columns)
+                df.to_csv(output_path, sep=';', index=False, mode='a' if chunk_number else 'w',
+                          header=not chunk_number)
+                first_row += len(chunk)
+    except BaseException:
+        journal.close()
+        raise
+    journal.close(remove=True)
 
-# Add all new rows at once if there are any
-if new_rows:
-    df = pd.concat([df, pd.DataFrame(new_rows)], ignore_index=True)
 
+for input_filename in args.input:
+    geocode_file(input_filename)
+if args.engine == 'thread':
+    close_session()
 
-output_dir = 'output'
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
+if geocode_cache is not None:
+    for tier_name, tier in geocode_cache.tiers():
+        print(f"Cache ({tier_name}): {tier.hits} hits, {tier.misses} misses, {tier.evictions} evictions")
+    if geocode_cache.bloom_skips:
+        print(f"Bloom filter skipped {geocode_cache.bloom_skips} cache file lookups for new addresses")
+    if geocode_cache.negative_hits:
+        print(f"Skipped {geocode_cache.negative_hits} addresses the API recently found nothing for")
+    geocode_cache.close()
+if get_coalescer().shared:
+    print(f"Coalesced {get_coalescer().shared} lookups into requests already in flight")
+if hedging is not None:
+    print(f"Hedged {hedging.hedges} of {hedging.requests} requests")
 
-input_filepath = os.path.basename(input_filename + f'-{api_type}.csv')
-output_path = os.path.join(output_dir, input_filepath)
-df.to_csv(output_path, sep=';', index=False)
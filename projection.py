@@ -0,0 +1,78 @@
+import os
+import threading
+import numpy as np
+import pyproj
+
+WGS84 = 'EPSG:4326'
+
+_local = threading.local()
+
+
+def get_transformer(source_crs, target_crs):
+    """Transformer from source_crs to target_crs, in x/y (lng/lat) order, for the calling thread
+
+    pyproj transformers must not be shared between threads, so each thread
+    gets its own, created on first use and reused for every later call with
+    the same CRS pair. A forked worker process starts over with fresh ones.
+    """
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.transformers = {}
+    key = (source_crs, target_crs)
+    transformer = _local.transformers.get(key)
+    if transformer is None:
+        transformer = _local.transformers[key] = pyproj.Transformer.from_crs(source_crs, target_crs, always_xy=True)
+    return transformer
+
+
+def project(x, y, target_crs, source_crs=WGS84):
+    """Project arrays of x (longitude) and y (latitude) coordinates to target_crs in a single call
+
+    Returns the projected (x, y) arrays. Safe to call from any thread.
+    """
+    return get_transformer(source_crs, target_crs).transform(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+
+def sirgas_utm_epsg(zone, south=True):
+    """EPSG code of SIRGAS 2000 / UTM zone `zone` S (or N), e.g. 22S -> 31982"""
+    if south:
+        if 17 <= zone <= 25:
+            return 31960 + zone
+        if zone == 26:
+            return 5396
+    else:
+        if 11 <= zone <= 22:
+            return 31954 + zone
+        if zone in (23, 24):
+            return 6187 + zone
+    raise ValueError(f"SIRGAS 2000 has no UTM zone {zone}{'S' if south else 'N'}")
+
+
+def utm_zones(lon):
+    """UTM zone number (1-60) of each longitude"""
+    return np.floor((np.asarray(lon, dtype=float) + 180) / 6).astype(np.int64) % 60 + 1
+
+
+def project_utm(lon, lat):
+    """Project WGS84 points to the SIRGAS 2000 UTM zone each one falls in
+
+    Points are grouped by zone and hemisphere and every group is projected in
+    one batch. Returns x, y and the EPSG code of each point's zone; points in
+    a zone SIRGAS 2000 does not define get NaN coordinates and code 0.
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    zones = utm_zones(lon)
+    south = lat < 0
+    x = np.full(len(lon), np.nan)
+    y = np.full(len(lon), np.nan)
+    codes = np.zeros(len(lon), dtype=np.int64)
+    for zone, is_south in set(zip(zones.tolist(), south.tolist())):
+        try:
+            code = sirgas_utm_epsg(zone, is_south)
+        except ValueError:
+            continue
+        group = (zones == zone) & (south == is_south)
+        x[group], y[group] = project(lon[group], lat[group], f'EPSG:{code}')
+        codes[group] = code
+    return x, y, codes
@@ -14,20 +14,23 @@ Options:
   --file=FILENAME    Specify the input CSV file (default: Campo_Mourão_teste_api_pontos.csv)
   --max=N            Limit the number of markers to N
   --no-fast          Use regular MarkerCluster instead of FastMarkerCluster
+  --crs=CRS          CRS of points without an SRID of their own (default: EPSG:31982)
   --help, -h         Show this help message and exit
 """
 
 import pandas as pd
 import folium
 from folium.plugins import MarkerCluster, FastMarkerCluster
-from pyproj import Transformer
 import numpy as np
 import sys
+from geometry import parse_points
+from projection import project, WGS84
 
 # Parse command line arguments
 max_markers = None
 use_fast_markers = True
 input_filename = 'Campo_Mourão_teste_api_pontos.csv'
+source_crs = 'EPSG:31982'
 show_help = False
 
 if len(sys.argv) > 1:
@@ -41,6 +44,8 @@ if len(sys.argv) > 1:
             use_fast_markers = False
         elif arg.startswith('--file='):
             input_filename = arg.split('=')[1]
+        elif arg.startswith('--crs='):
+            source_crs = arg.split('=')[1]
         elif arg in ['--help', '-h']:
             show_help = True
 
@@ -50,27 +55,35 @@ if show_help:
     print("  --file=FILENAME    Specify the input CSV file (default: Campo_Mourão_teste_api_pontos.csv)")
     print("  --max=N            Limit the number of markers to N")
     print("  --no-fast          Use regular MarkerCluster instead of FastMarkerCluster")
+    print("  --crs=CRS          CRS of points without an SRID of their own (default: EPSG:31982)")
     print("  --help, -h         Show this help message and exit")
     sys.exit(0)
 
 # Read the CSV file
 df = pd.read_csv(f'output/{input_filename}', sep=';')
 
-# Extract X and Y coordinates from the POINT string
-df['x'] = df['the_geom'].str.extract(r'POINT\(([\d.]+)')
-df['y'] = df['the_geom'].str.extract(r'([\d.]+)\)')
-
-# Convert strings to float
-df['x'] = df['x'].astype(float)
-df['y'] = df['y'].astype(float)
-
-# Create transformer from UTM zone 22S (EPSG:31982) to WGS84 (EPSG:4326)
-transformer = Transformer.from_crs('EPSG:31982', 'EPSG:4326', always_xy=True)
-
-# Convert coordinates
-coords = [transformer.transform(x, y) for x, y in zip(df['x'], df['y'])]
-df['longitude'] = [coord[0] for coord in coords]
-df['latitude'] = [coord[1] for coord in coords]
+# Extract X and Y coordinates from the_geom, written as WKT or hex (E)WKB, unless
+# main.py --geometry-format xy already wrote them to columns of their own
+x, y, srid = parse_points(df['the_geom'])
+if 'x' in df.columns and 'y' in df.columns:
+    df['x'] = df['x'].astype(float).fillna(pd.Series(x, index=df.index))
+    df['y'] = df['y'].astype(float).fillna(pd.Series(y, index=df.index))
+else:
+    df['x'] = x
+    df['y'] = y
+
+# Convert coordinates back to WGS84 (EPSG:4326), one call per CRS. The CRS of a point comes
+# from the srid column written by main.py --target-crs auto, else from its EWKB, else --crs
+point_crs = pd.Series(source_crs, index=df.index)
+point_crs[srid > 0] = 'EPSG:' + pd.Series(srid, index=df.index)[srid > 0].astype(str)
+if 'srid' in df.columns:
+    has_srid = df['srid'].notna()
+    point_crs[has_srid] = 'EPSG:' + df.loc[has_srid, 'srid'].astype('int64').astype(str)
+df['longitude'] = np.nan
+df['latitude'] = np.nan
+for crs, index in point_crs.groupby(point_crs).groups.items():
+    df.loc[index, 'longitude'], df.loc[index, 'latitude'] = project(df.loc[index, 'x'], df.loc[index, 'y'], WGS84,
+                                                                    source_crs=crs)
 
 # Filter out rows with NaN values in latitude or longitude
 valid_df = df.dropna(subset=['latitude', 'longitude'])